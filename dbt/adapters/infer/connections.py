@@ -1,5 +1,8 @@
 import json
 import os
+import shutil
+import tempfile
+import uuid
 from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import Any, Dict, Optional, Tuple
@@ -10,6 +13,7 @@ import requests
 import dbt.exceptions
 from dbt.adapters.base import BaseConnectionManager, Credentials
 from dbt.adapters.factory import get_adapter_class_by_name, load_plugin
+from dbt.adapters.infer import memory, tracing
 from dbt.contracts.connection import AdapterResponse
 from dbt.logger import GLOBAL_LOGGER as logger
 
@@ -44,10 +48,9 @@ class InferCredentials(Credentials):
 
     def __getattr__(self, name):
         if name == "adapter_credentials":
-            _, cls = InferConnectionManager.get_source_module(self.data_config)
-            data = cls.translate_aliases(self.data_config)
-            cls.validate(data)
-            self.adapter_credentials = cls.from_dict(data)
+            self.adapter_credentials = InferConnectionManager.get_source_credentials(
+                self.data_config
+            )
             return self.adapter_credentials
         return getattr(self.adapter_credentials, name)
 
@@ -83,17 +86,23 @@ class InferSession:
             }
         )
         url = f"{credentials.url}/api/v1"
-        r = session.get(f"{url}/users/me")
+        self.__baseurl = credentials.url
+        self.__url = url
+        self.__session = session
+        r = self.__request("GET", f"{url}/users/me")
         if r.status_code != 200:
             raise RuntimeError(
                 f'Failed to connect to Infer server {url} end point "/users/me" {r.text}'
             )
-        self.__baseurl = credentials.url
-        self.__url = url
-        self.__session = session
+
+    def __request(self, method, url, **kwargs):
+        with tracing.span("infer.http", **{"http.method": method, "http.url": url}):
+            r = self.__session.request(method, url, **kwargs)
+            tracing.set_attribute("http.status_code", r.status_code)
+            return r
 
     def parse(self, sql):
-        r = self.__session.post(f"{self.__url}/parse", json={"q": sql})
+        r = self.__request("POST", f"{self.__url}/parse", json={"q": sql})
         if r.status_code != 200:
             raise RuntimeError(
                 f"Failed to connect to Infer server {self.__url} end "
@@ -102,17 +111,43 @@ class InferSession:
         return r.json()["result"]
 
     def dbt_run(self, name, query, datasets):
-        r = self.__session.post(
-            f"{self.__url}/dbt_runs",
-            json={
-                "dbt_run": {
-                    "name": name,
-                    "description": name,
-                    "query": query,
-                    "datasets": datasets,
+        payload = {
+            "dbt_run": {
+                "name": name,
+                "description": name,
+                "query": query,
+                "datasets": datasets,
+            }
+        }
+        spilled = [dataset for dataset in datasets if "base64_path" in dataset]
+        if not spilled:
+            r = self.__request("POST", f"{self.__url}/dbt_runs", json=payload)
+        else:
+            # datasets spilled to disk are streamed into the request body from a file
+            marker = f"__INFER_DATASET_{uuid.uuid4().hex}"
+            payload["dbt_run"]["datasets"] = [
+                {
+                    "base64": f"{marker}_{i}__",
+                    "filename": dataset["filename"],
+                    "table_query": dataset["table_query"],
                 }
-            },
-        )
+                if "base64_path" in dataset
+                else dataset
+                for i, dataset in enumerate(datasets)
+            ]
+            body = json.dumps(payload)
+            spill_dir = os.path.dirname(spilled[0]["base64_path"])
+            with tempfile.TemporaryFile(dir=spill_dir) as fp:
+                for i, dataset in enumerate(datasets):
+                    if "base64_path" not in dataset:
+                        continue
+                    head, body = body.split(f"{marker}_{i}__", 1)
+                    fp.write(head.encode())
+                    with open(dataset["base64_path"], "rb") as dataset_fp:
+                        shutil.copyfileobj(dataset_fp, fp)
+                fp.write(body.encode())
+                fp.seek(0)
+                r = self.__request("POST", f"{self.__url}/dbt_runs", data=fp)
         if r.status_code != 200:
             raise RuntimeError(
                 f"Failed to run `dbt_run` on {self.__url} "
@@ -120,8 +155,8 @@ class InferSession:
             )
         return r.json()["id"]
 
-    def get_dbt_result(self, result_id):
-        r = self.__session.get(f"{self.__url}/dbt_runs/{result_id}")
+    def get_dbt_result(self, result_id, spill_path=None):
+        r = self.__request("GET", f"{self.__url}/dbt_runs/{result_id}")
         if r.status_code != 200:
             raise RuntimeError(
                 f"Failed to connect to Infer server {self.__url} "
@@ -135,13 +170,24 @@ class InferSession:
         if r_status == "COMPLETED":
             url = f"{self.__baseurl}{r_json['output_url']}"
             info = r_json.get("info", [])
-            r = self.__session.get(url)
-            if r.status_code != 200:
-                raise RuntimeError(
-                    f"Failed to connect to retrieve result {url} "
-                    f"got return code {r.status_code}"
-                )
-            rtn_obj = r.content
+            with self.__request("GET", url, stream=True) as r:
+                if r.status_code != 200:
+                    raise RuntimeError(
+                        f"Failed to connect to retrieve result {url} "
+                        f"got return code {r.status_code}"
+                    )
+                content_length = r.headers.get("Content-Length")
+                # results of unknown size are spilled, as they may be of any size
+                if spill_path and (
+                    content_length is None or memory.should_spill(int(content_length))
+                ):
+                    # large results are written straight to disk and returned as a path
+                    with open(spill_path, "wb") as fp:
+                        for chunk in r.iter_content(chunk_size=memory.B64_CHUNK_SIZE):
+                            fp.write(chunk)
+                    rtn_obj = spill_path
+                else:
+                    rtn_obj = r.content
         elif r_status == "ERROR":
             rtn_obj = r_json["raw_output"]
         return r_status, rtn_obj, info
@@ -150,9 +196,18 @@ class InferSession:
         self.__session.close()
 
 
+def _data_config_key(data_config: Dict[str, Any]) -> str:
+    return json.dumps(data_config, sort_keys=True, default=str)
+
+
 class InferConnectionManager(BaseConnectionManager):
     TYPE = "infer"
 
+    # plugin and credentials resolution is the same for every connection
+    # sharing a data_config, so it is only done once per process
+    _source_modules: Dict[str, Tuple[Any, Any]] = {}
+    _source_credentials: Dict[str, Credentials] = {}
+
     @contextmanager
     def exception_handler(self, sql: str):
         try:
@@ -168,8 +223,23 @@ class InferConnectionManager(BaseConnectionManager):
     @classmethod
     def get_source_module(cls, source):
         source_type = source["type"]
-        credentials = load_plugin(source_type)
-        return get_adapter_class_by_name(source_type), credentials
+        if source_type not in cls._source_modules:
+            credentials = load_plugin(source_type)
+            cls._source_modules[source_type] = (
+                get_adapter_class_by_name(source_type),
+                credentials,
+            )
+        return cls._source_modules[source_type]
+
+    @classmethod
+    def get_source_credentials(cls, source):
+        key = _data_config_key(source)
+        if key not in cls._source_credentials:
+            _, credentials_cls = cls.get_source_module(source)
+            data = credentials_cls.translate_aliases(source)
+            credentials_cls.validate(data)
+            cls._source_credentials[key] = credentials_cls.from_dict(data)
+        return cls._source_credentials[key]
 
     @classmethod
     def open(cls, connection):
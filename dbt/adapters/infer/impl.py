@@ -1,8 +1,15 @@
 import base64
+import copy
 import io
 import os
+import re
+import shutil
+import threading
 import uuid
-from time import sleep
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import sleep, time
 from typing import Any, Dict, List, Optional, Tuple
 
 import agate
@@ -11,16 +18,125 @@ from dbt.adapters.base import BaseAdapter
 from dbt.adapters.base import Column as BaseColumn
 from dbt.adapters.base.meta import available
 from dbt.adapters.base.relation import BaseRelation
-from dbt.adapters.infer import InferConnectionManager
+from dbt.adapters.infer import InferConnectionManager, memory, tracing
 from dbt.clients import agate_helper
 from dbt.contracts.connection import AdapterResponse, Connection
 from dbt.contracts.results import RunStatus
 from dbt.events import AdapterLogger
 from dbt.exceptions import DbtRuntimeError as RuntimeException
-from dbt.task.seed import SeedTask
 
 logger = AdapterLogger("Infer")
 
+SAMPLE_METHODS = ("random", "hash", "limit")
+
+# temp tables are named tmp_infer_<unix timestamp>_<uuid> so stale ones can be swept
+TMP_TABLE_PREFIX = "tmp_infer_"
+TMP_TABLE_PATTERN = re.compile(r"tmp_infer_(\d{10})_[0-9a-f]{32}", re.IGNORECASE)
+
+# dialect specific SQL used when rewriting load queries, keyed by source adapter type
+RANDOM_FUNCTIONS = {"bigquery": "RAND()", "databricks": "RAND()", "spark": "RAND()"}
+HASH_FUNCTIONS = {
+    "bigquery": "FARM_FINGERPRINT(CAST({} AS STRING))",
+    "snowflake": "HASH({})",
+    "databricks": "XXHASH64({})",
+    "spark": "XXHASH64({})",
+    "duckdb": "HASH({})",
+    "postgres": "HASHTEXT(CAST({} AS TEXT))",
+    "redshift": "STRTOL(LEFT(MD5(CAST({} AS VARCHAR)), 8), 16)",
+}
+EXCLUDE_COLUMNS = {
+    "bigquery": "* EXCEPT ({})",
+    "databricks": "* EXCEPT ({})",
+    "snowflake": "* EXCLUDE ({})",
+    "duckdb": "* EXCLUDE ({})",
+}
+
+
+def _is_positive_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _is_column_list(value: Any) -> bool:
+    return isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value)
+
+
+def rewrite_load_query(query: str, adapter, load_config: Dict[str, Any]) -> str:
+    source_type = adapter.type()
+    sample_rows = load_config.get("sample_rows")
+    sample_method = load_config.get("sample_method") or "random"
+    sample_key = load_config.get("sample_key")
+    sample_modulo = load_config.get("sample_modulo")
+    include_columns = load_config.get("include_columns")
+    exclude_columns = load_config.get("exclude_columns")
+    if sample_method not in SAMPLE_METHODS:
+        raise RuntimeException(
+            f"`infer_sample_method` must be one of {', '.join(SAMPLE_METHODS)}, "
+            f"got {sample_method}"
+        )
+    if sample_rows is not None and not _is_positive_int(sample_rows):
+        raise RuntimeException(
+            f"`infer_sample_rows` must be a positive integer, got {sample_rows}"
+        )
+    for name, columns in [
+        ("infer_include_columns", include_columns),
+        ("infer_exclude_columns", exclude_columns),
+    ]:
+        if columns is not None and not _is_column_list(columns):
+            raise RuntimeException(f"`{name}` must be a list of column names, got {columns!r}")
+    hash_sample = sample_method == "hash"
+    if not sample_rows and not hash_sample and not include_columns and not exclude_columns:
+        return query
+
+    if include_columns and exclude_columns:
+        raise RuntimeException(
+            "Only one of `infer_include_columns` and `infer_exclude_columns` can be set"
+        )
+    if include_columns:
+        columns = ", ".join(adapter.quote(column) for column in include_columns)
+    elif exclude_columns:
+        if source_type not in EXCLUDE_COLUMNS:
+            raise RuntimeException(
+                f"`infer_exclude_columns` is not supported for {source_type}, "
+                f"use `infer_include_columns` instead"
+            )
+        columns = EXCLUDE_COLUMNS[source_type].format(
+            ", ".join(adapter.quote(column) for column in exclude_columns)
+        )
+    else:
+        columns = "*"
+    rewritten = f"SELECT {columns} FROM ({query}) AS infer_load"
+
+    if hash_sample:
+        if not sample_key:
+            raise RuntimeException("`infer_sample_method: hash` requires `infer_sample_key`")
+        if not _is_positive_int(sample_modulo):
+            raise RuntimeException(
+                f"`infer_sample_method: hash` requires `infer_sample_modulo` to be a positive "
+                f"integer, got {sample_modulo}"
+            )
+        if source_type not in HASH_FUNCTIONS:
+            raise RuntimeException(
+                f"`infer_sample_method: hash` is not supported for {source_type}"
+            )
+        # keeps the rows whose hashed key falls in 1 of sample_modulo buckets
+        hashed_key = HASH_FUNCTIONS[source_type].format(adapter.quote(sample_key))
+        rewritten = f"{rewritten} WHERE MOD({hashed_key}, {sample_modulo}) = 0"
+        return f"{rewritten} LIMIT {sample_rows}" if sample_rows else rewritten
+    if not sample_rows:
+        return rewritten
+    if sample_method == "random":
+        if source_type == "snowflake":
+            return f"{rewritten} SAMPLE ({sample_rows} ROWS)"
+        random_function = RANDOM_FUNCTIONS.get(source_type, "RANDOM()")
+        return f"{rewritten} ORDER BY {random_function} LIMIT {sample_rows}"
+    return f"{rewritten} LIMIT {sample_rows}"
+
+
+def is_stale_temp_relation(identifier: Optional[str], cutoff: float) -> bool:
+    # only tables with the exact generated name are ever dropped
+    match = TMP_TABLE_PATTERN.fullmatch(identifier or "")
+    return bool(match) and int(match.group(1)) < cutoff
+
 
 class InferAdapter(BaseAdapter):
     SourceAdapter = None
@@ -33,6 +149,25 @@ class InferAdapter(BaseAdapter):
         self.config = config
         self.data_adapter = None
         self.create_view_mode = False
+        self.load_configs = threading.local()
+        # temp tables holding Infer results are dropped together at the end of the run
+        self.temp_relations: List[BaseRelation] = []
+        self.temp_relations_lock = threading.Lock()
+        self.sweep_thread: Optional[threading.Thread] = None
+        self.seeding = threading.local()
+        # SQL-inf models in the same run often share load queries, so encoded datasets
+        # are reused while models use them and up to a size limit once they are unused
+        self.datasets: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.datasets_lock = threading.Lock()
+        self.dataset_locks: Dict[str, threading.Lock] = {}
+        self.dataset_users: Dict[str, int] = {}
+        self.dataset_cache_bytes = memory.env_megabytes("INFER_DATASET_CACHE_MB", "64") or 0
+        # the process peak RSS is only reset while no SQL-inf model is running
+        self.infer_models_running = 0
+        self.infer_models_lock = threading.Lock()
+        self.peak_rss_reset = False
+        # fail on a malformed budget before any model runs
+        memory.memory_budget()
 
     @classmethod
     def is_cancelable(cls) -> bool:
@@ -54,6 +189,7 @@ class InferAdapter(BaseAdapter):
     def date_function(cls):
         return cls.SourceAdapter.date_function()
 
+    @tracing.traced("infer.upload_data_to_table")
     def upload_data_to_table(self, table_name, result, adapter):
         logger.info(f"Uploading data to {table_name}")
         seed_paths = self.config.seed_paths
@@ -63,8 +199,17 @@ class InferAdapter(BaseAdapter):
         full_seed_path = os.path.join(project_root, seed_path)
         if not os.path.exists(full_seed_path):
             os.makedirs(full_seed_path)
-        with open(output_file_path, "w+b") as fp:
-            fp.write(result)
+        if isinstance(result, str):
+            # result was spilled to disk while downloading
+            shutil.move(result, output_file_path)
+        else:
+            with open(output_file_path, "w+b") as fp:
+                fp.write(result)
+        if tracing.tracing_enabled():
+            tracing.set_attribute("infer.result.bytes", os.path.getsize(output_file_path))
+            tracing.set_attribute(
+                "infer.result.rows", max(memory.count_lines(output_file_path) - 1, 0)
+            )
 
         class SeedArgs:
             state = None
@@ -79,19 +224,198 @@ class InferAdapter(BaseAdapter):
             write_json = None
 
         from dbt.parser.manifest import ManifestLoader
+        from dbt.task.seed import SeedTask
 
         manifest = ManifestLoader.get_full_manifest(adapter.config)
 
+        # SeedTask schedules nodes by the run's single_threaded flag, so it gets its own copy of
+        # the config to run on this thread and be included in the model's profile and spans
+        seed_config = copy.copy(adapter.config)
+        seed_config.args = copy.copy(adapter.config.args)
+        object.__setattr__(seed_config.args, "single_threaded", True)
+
         logger.info(f"Creating SeedTask")
-        task = SeedTask(SeedArgs(), adapter.config, manifest)
+        task = SeedTask(SeedArgs(), seed_config, manifest)
         logger.info(f"Running Task")
-        r = task.run()
+        self.seeding.active = True
+        try:
+            r = task.run()
+        finally:
+            self.seeding.active = False
         logger.info(f"Task finished")
         if r.results[0].status == RunStatus.Error:
             raise RuntimeException(r.results[0].message)
         os.remove(output_file_path)
 
+    def spill_path(self, name):
+        spill_dir = os.path.join(self.config.project_root, self.config.target_path, "infer_spill")
+        os.makedirs(spill_dir, exist_ok=True)
+        return os.path.join(spill_dir, name)
+
+    def release_datasets(self, load_queries):
+        with self.datasets_lock:
+            for load_query in load_queries:
+                self.dataset_users[load_query] -= 1
+                if not self.dataset_users[load_query]:
+                    del self.dataset_users[load_query]
+            # evict the least recently used datasets no model is using
+            unused = [q for q in self.datasets if q not in self.dataset_users]
+            cached_bytes = sum(entry["bytes"] for entry in self.datasets.values())
+            evicted = []
+            for load_query in unused:
+                if cached_bytes <= self.dataset_cache_bytes:
+                    break
+                entry = self.datasets.pop(load_query)
+                cached_bytes -= entry["bytes"]
+                evicted.append(entry)
+            for load_query in list(self.dataset_locks):
+                if load_query not in self.datasets and load_query not in self.dataset_users:
+                    del self.dataset_locks[load_query]
+        self.remove_spilled_datasets(evicted)
+
+    def clear_datasets(self):
+        with self.datasets_lock:
+            datasets, self.datasets = self.datasets, OrderedDict()
+            self.dataset_locks = {}
+            self.dataset_users = {}
+        self.remove_spilled_datasets(datasets.values())
+
+    def remove_spilled_datasets(self, entries):
+        for entry in entries:
+            path = entry["dataset"].get("base64_path")
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def create_temp_relation(self, adapter):
+        identifier = f"{TMP_TABLE_PREFIX}{int(time())}_{uuid.uuid4().hex}"
+        relation = adapter.Relation.create(
+            database=adapter.config.credentials.database,
+            schema=adapter.config.credentials.schema,
+            identifier=identifier,
+            type="table",
+            quote_policy=adapter.config.quoting,
+        )
+        with self.temp_relations_lock:
+            self.temp_relations.append(relation)
+        return relation
+
+    def start_sweep(self, adapter):
+        with self.temp_relations_lock:
+            if self.sweep_thread is None:
+                self.sweep_thread = threading.Thread(
+                    target=self.sweep_temp_relations, args=(adapter,), daemon=True
+                )
+                self.sweep_thread.start()
+
+    def sweep_temp_relations(self, adapter):
+        ttl_hours = float(os.getenv("INFER_TMP_TABLE_TTL_HOURS", "24"))
+        if ttl_hours <= 0:
+            return
+        cutoff = time() - ttl_hours * 3600
+        schema_relation = adapter.Relation.create(
+            database=adapter.config.credentials.database,
+            schema=adapter.config.credentials.schema,
+            quote_policy=adapter.config.quoting,
+        )
+        try:
+            with adapter.connection_named("infer_sweep"):
+                for relation in adapter.list_relations_without_caching(schema_relation):
+                    if is_stale_temp_relation(relation.identifier, cutoff):
+                        logger.info(f"Dropping stale temp table {relation}")
+                        adapter.drop_relation(relation)
+        except Exception as e:
+            logger.warning(f"Failed to sweep stale {TMP_TABLE_PREFIX} tables: {e}")
+
+    def drop_temp_relations(self):
+        with self.temp_relations_lock:
+            relations, self.temp_relations = self.temp_relations, []
+            sweep_thread, self.sweep_thread = self.sweep_thread, None
+        if sweep_thread:
+            sweep_thread.join()
+        if not relations:
+            return
+        adapter = self.data_adapter
+        logger.info(f"Dropping {len(relations)} temp tables")
+
+        def drop(relation):
+            with adapter.connection_named("infer_cleanup"):
+                adapter.drop_relation(relation)
+
+        with ThreadPoolExecutor(max_workers=min(len(relations), self.config.threads)) as pool:
+            futures = [(relation, pool.submit(drop, relation)) for relation in relations]
+        for relation, future in futures:
+            if future.exception():
+                logger.warning(f"Failed to drop temp table {relation}: {future.exception()}")
+
+    def cleanup_connections(self) -> None:
+        # SeedTask cleans up connections after each upload, which is not the end of the run
+        if not getattr(self.seeding, "active", False):
+            self.drop_temp_relations()
+            self.clear_datasets()
+        super().cleanup_connections()
+
+    @tracing.traced("infer.load_dataset")
+    def load_dataset(self, query, adapter, load_config=None):
+        load_query = rewrite_load_query(query, adapter, load_config or {})
+        with self.datasets_lock:
+            query_lock = self.dataset_locks.setdefault(load_query, threading.Lock())
+            self.dataset_users[load_query] = self.dataset_users.get(load_query, 0) + 1
+        try:
+            return load_query, self.get_or_load_dataset(query, load_query, query_lock, adapter)
+        except Exception:
+            self.release_datasets([load_query])
+            raise
+
+    def get_or_load_dataset(self, query, load_query, query_lock, adapter):
+        # models waiting on the same query block here until the first one has loaded it
+        with query_lock:
+            tracing.set_attribute("infer.dataset.reused", load_query in self.datasets)
+            if load_query in self.datasets:
+                logger.info(f"Reusing loaded dataset for inner query {load_query}")
+                with self.datasets_lock:
+                    self.datasets.move_to_end(load_query)
+                entry = self.datasets[load_query]
+                if tracing.tracing_enabled():
+                    # rows are only counted when tracing was on as the dataset was loaded
+                    if entry["rows"] is not None:
+                        tracing.set_attribute("infer.dataset.rows", entry["rows"])
+                    tracing.set_attribute("infer.dataset.bytes", entry["bytes"])
+                return entry["dataset"]
+            logger.info(f"Executing inner query {load_query} using {adapter.__class__.__name__}")
+            result = adapter.execute(load_query, False, True)
+            dataset_name = "tmp_" + str(uuid.uuid4()).replace("-", "")
+            dataset = {"filename": dataset_name, "table_query": query}
+            if memory.should_spill(memory.estimate_table_size(result[1])):
+                logger.info(f"Saving output to file, over memory budget so spilling to disk")
+                csv_path = self.spill_path(f"{dataset_name}.csv")
+                dataset["base64_path"] = self.spill_path(f"{dataset_name}.b64")
+                result[1].to_csv(csv_path)
+                memory.b64encode_file(csv_path, dataset["base64_path"])
+                os.remove(csv_path)
+                dataset_bytes = os.path.getsize(dataset["base64_path"])
+            else:
+                fp = io.StringIO()
+                logger.info(f"Saving output to file")
+                result[1].to_csv(fp)
+                encoded_fp = base64.b64encode(fp.getvalue().encode())
+                fp.close()
+                dataset["base64"] = encoded_fp.decode()
+                dataset_bytes = len(encoded_fp)
+            dataset_rows = None
+            if tracing.tracing_enabled():
+                dataset_rows = len(result[1].rows)
+                tracing.set_attribute("infer.dataset.rows", dataset_rows)
+                tracing.set_attribute("infer.dataset.bytes", dataset_bytes)
+            with self.datasets_lock:
+                self.datasets[load_query] = {
+                    "dataset": dataset,
+                    "bytes": dataset_bytes,
+                    "rows": dataset_rows,
+                }
+            return dataset
+
     @available.parse(lambda *a, **k: ("", agate_helper.empty_table()))
+    @tracing.traced("infer.execute")
     def execute(
         self, sql: str, auto_begin: bool = False, fetch: bool = False
     ) -> Tuple[AdapterResponse, agate.Table]:
@@ -101,6 +425,11 @@ class InferAdapter(BaseAdapter):
             # we assume that we are in a nested execution
             with adapter.connection_named("master"):
                 return adapter.execute(sql, auto_begin, fetch)
+        tracing.set_attribute("dbt.connection", thread_connection.name)
+        # stale temp tables are swept in the background from the first statement of a run
+        self.start_sweep(adapter)
+        # the load config applies only to the statement following create_table_as
+        load_config = self.load_configs.__dict__.pop("config", {})
         data_source = thread_connection.handle
         session = data_source["session"]
         parsed_sql = session.parse(sql)
@@ -118,38 +447,67 @@ class InferAdapter(BaseAdapter):
         if self.create_view_mode:
             raise RuntimeException("SQL-inf commands can only be used with TABLE materializations")
 
+        profile_path = os.path.join(
+            self.config.project_root,
+            self.config.target_path,
+            "infer_profiles",
+            f"{thread_connection.name}.pstats",
+        )
+        with tracing.profile(profile_path), self.track_peak_rss():
+            return self.execute_infer(sql, parsed_sql, session, adapter, load_config)
+
+    @contextmanager
+    def track_peak_rss(self):
+        # resetting while other models run would drop their peaks, so the peak reported for a
+        # model covers its whole run and may include SQL-inf models running at the same time
+        with self.infer_models_lock:
+            if not self.infer_models_running:
+                self.peak_rss_reset = memory.reset_peak_rss()
+            self.infer_models_running += 1
+            peak_rss_reset = self.peak_rss_reset
+        try:
+            yield
+        finally:
+            with self.infer_models_lock:
+                self.infer_models_running -= 1
+        peak_rss = memory.peak_rss()
+        if peak_rss:
+            # without a reset only the peak since the process started is available
+            scope = "while running" if peak_rss_reset else "of the process after"
+            logger.info(f"Peak RSS {scope} SQL-inf query {peak_rss / 1024 / 1024:.0f}MB")
+            tracing.set_attribute("process.peak_rss_bytes", peak_rss)
+
+    def execute_infer(self, sql, parsed_sql, session, adapter, load_config):
+        load_queries = []
         datasets = []
-        with adapter.connection_named("load_queries"):
-            logger.info(f"Executing inner load queries for SQL-inf query")
-            for query in parsed_sql["load_queries"]:
-                logger.info(f"Executing inner query {query} using {adapter.__class__.__name__}")
-                result = adapter.execute(query, False, True)
-                dataset_name = "tmp_" + str(uuid.uuid4()).replace("-", "")
-                fp = io.StringIO()
-                logger.info(f"Saving output to file")
-                result[1].to_csv(fp)
-                encoded_fp = base64.b64encode(fp.getvalue().encode())
-                datasets.append(
-                    {
-                        "base64": encoded_fp.decode(),
-                        "filename": dataset_name,
-                        "table_query": query,
-                    }
-                )
-                fp.close()
-
-        logger.info(f"Executing SQL-inf query")
-        result_id = session.dbt_run(name="dbt_run", query=sql, datasets=datasets)
+        try:
+            with adapter.connection_named("load_queries"):
+                logger.info(f"Executing inner load queries for SQL-inf query")
+                for query in parsed_sql["load_queries"]:
+                    load_query, dataset = self.load_dataset(query, adapter, load_config)
+                    load_queries.append(load_query)
+                    datasets.append(dataset)
+
+            logger.info(f"Executing SQL-inf query")
+            result_id = session.dbt_run(name="dbt_run", query=sql, datasets=datasets)
+        finally:
+            self.release_datasets(load_queries)
+        tracing.set_attribute("infer.job_id", result_id)
 
         keep_running = True
         result = {}
         result_status = "STARTED"
         result_info = []
+        poll_count = 0
         logger.info(f"Query execution started - waiting for results")
+        spill_path = self.spill_path(f"{result_id}.csv") if memory.memory_budget() else None
         while keep_running:
-            result_status, result, result_info = session.get_dbt_result(result_id)
+            result_status, result, result_info = session.get_dbt_result(result_id, spill_path)
+            poll_count += 1
             keep_running = result_status in ["STARTED", "RUNNING"]
             sleep(3)
+        tracing.set_attribute("infer.poll_count", poll_count)
+        tracing.set_attribute("infer.job_status", result_status)
         logger.info(f"Query execution finished - parsing results")
         if result_status == "ERROR":
             if result:
@@ -164,7 +522,8 @@ class InferAdapter(BaseAdapter):
         for info in result_info:
             logger.info(f"Infer {info['type']}: {info['msg']}")
 
-        temp_table_name = "tmp_infer_" + str(uuid.uuid4()).replace("-", "")
+        relation = self.create_temp_relation(adapter)
+        temp_table_name = relation.identifier
 
         self.upload_data_to_table(temp_table_name, result, adapter)
 
@@ -176,18 +535,6 @@ class InferAdapter(BaseAdapter):
             logger.info(f"Executing out query {outer_sql} using {adapter.__class__.__name__}")
             outer_result = adapter.execute(outer_sql, False, True)
 
-            database = adapter.config.credentials.database
-            schema = adapter.config.credentials.schema
-            relation = adapter.Relation.create(
-                database=database,
-                schema=schema,
-                identifier=temp_table_name,
-                type="table",
-                quote_policy=adapter.config.quoting,
-            )
-
-        adapter.drop_relation(relation)
-
         return outer_result
 
     def get_data_adapter(self):
@@ -200,6 +547,11 @@ class InferAdapter(BaseAdapter):
     def set_create_view_mode(self, view_mode):
         self.create_view_mode = view_mode
 
+    @available.parse(lambda *a, **k: {})
+    def set_load_config(self, load_config):
+        # kept per thread as models build concurrently
+        self.load_configs.config = {k: v for k, v in load_config.items() if v is not None}
+
     @available.parse(lambda *a, **k: {})
     def adapter_macro(self, macro, macro_dict):
         data_adapter = self.get_data_adapter()
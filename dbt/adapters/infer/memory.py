@@ -0,0 +1,105 @@
+import base64
+import mmap
+import os
+import sys
+from functools import lru_cache
+from typing import Optional
+
+from dbt.exceptions import DbtRuntimeError as RuntimeException
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+# base64 encodes 3 bytes at a time, so chunks are kept to a multiple of 3
+B64_CHUNK_SIZE = 3 * 1024 * 1024
+# copies of a dataset held while it is written as csv, base64 encoded and sent as json
+DATASET_COPIES = 6
+
+
+@lru_cache(maxsize=None)
+def _parse_megabytes(name: str, value: str) -> int:
+    try:
+        megabytes = float(value)
+    except ValueError:
+        raise RuntimeException(f"{name} must be a number of megabytes, got {value!r}")
+    if megabytes < 0:
+        raise RuntimeException(f"{name} must not be negative, got {value!r}")
+    return int(megabytes * 1024 * 1024)
+
+
+def env_megabytes(name: str, default: Optional[str] = None) -> Optional[int]:
+    value = os.getenv(name, default)
+    if not value:
+        return None
+    return _parse_megabytes(name, value)
+
+
+def memory_budget() -> Optional[int]:
+    return env_megabytes("INFER_MEMORY_BUDGET_MB")
+
+
+def reset_peak_rss() -> bool:
+    # resets VmHWM for the process, supported on Linux 4.0 and later
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+
+def should_spill(size: int) -> bool:
+    budget = memory_budget()
+    if budget is None:
+        return False
+    return (current_rss() or 0) + size > budget
+
+
+def estimate_table_size(table, sample_rows: int = 100) -> int:
+    rows = table.rows
+    if not rows:
+        return 0
+    sample = rows[:sample_rows]
+    sample_size = sum(len(",".join(str(v) for v in row)) + 1 for row in sample)
+    return sample_size * len(rows) // len(sample) * DATASET_COPIES
+
+
+def b64encode_file(src_path: str, dst_path: str):
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(B64_CHUNK_SIZE), b""):
+            dst.write(base64.b64encode(chunk))
+
+
+def count_lines(path: str) -> int:
+    if not os.path.getsize(path):
+        return 0
+    with open(path, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return sum(
+            mm[start : start + B64_CHUNK_SIZE].count(b"\n")
+            for start in range(0, len(mm), B64_CHUNK_SIZE)
+        )
@@ -0,0 +1,80 @@
+import cProfile
+import os
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+from dbt.events import AdapterLogger
+
+logger = AdapterLogger("Infer")
+
+TRUTHY = ("1", "true", "yes")
+
+
+def tracing_enabled() -> bool:
+    return os.getenv("INFER_TRACING", "").lower() in TRUTHY
+
+
+def profiling_enabled() -> bool:
+    return os.getenv("INFER_PROFILE", "").lower() in TRUTHY
+
+
+@lru_cache(maxsize=None)
+def get_tracer():
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logger.warning("INFER_TRACING is set but opentelemetry-api is not installed")
+        return None
+    return trace.get_tracer("dbt.adapters.infer")
+
+
+@contextmanager
+def span(name, **attributes):
+    tracer = get_tracer() if tracing_enabled() else None
+    if tracer is None:
+        yield
+        return
+    with tracer.start_as_current_span(name, attributes=attributes):
+        yield
+
+
+def traced(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_attribute(key, value):
+    if not tracing_enabled() or get_tracer() is None:
+        return
+    from opentelemetry import trace
+
+    trace.get_current_span().set_attribute(key, value)
+
+
+@contextmanager
+def profile(path):
+    if not profiling_enabled():
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # only one profiler can be active at a time on newer Pythons
+        logger.warning(f"Not profiling {path}: {e}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump_stats(path)
+        logger.info(f"Wrote profile to {path}")
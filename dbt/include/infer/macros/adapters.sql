@@ -11,6 +11,14 @@
 
 {% macro infer__create_table_as(temporary, relation, compiled_code, language='sql') -%}
     {% do adapter.set_create_view_mode(False) %}
+    {% do adapter.set_load_config({
+        'sample_rows': config.get('infer_sample_rows'),
+        'sample_method': config.get('infer_sample_method'),
+        'sample_key': config.get('infer_sample_key'),
+        'sample_modulo': config.get('infer_sample_modulo'),
+        'include_columns': config.get('infer_include_columns'),
+        'exclude_columns': config.get('infer_exclude_columns'),
+    }) %}
     {% do return(adapter.adapter_macro(
         'create_table_as',
         {'temporary': temporary, 'relation': relation, 'compiled_code': compiled_code, 'language': language}))
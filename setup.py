@@ -18,6 +18,7 @@ setup(
     packages=find_namespace_packages(include=["dbt", "dbt.*"]),
     include_package_data=True,
     install_requires=["dbt-core>=1.6.0", "requests"],
+    extras_require={"tracing": ["opentelemetry-api"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "License :: OSI Approved :: Apache Software License",
@@ -1,9 +1,28 @@
+import base64
 import os
+import tempfile
+import time
 import unittest
+from unittest import mock
+
+import agate
 
 from dbt.adapters.bigquery import BigQueryAdapter
-from dbt.adapters.infer import InferAdapter
+from dbt.adapters.infer import InferAdapter, memory, tracing
+from dbt.adapters.infer.impl import is_stale_temp_relation, rewrite_load_query
 from dbt.config.project import PartialProject
+from dbt.exceptions import DbtRuntimeError as RuntimeException
+
+try:
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+except ImportError:
+    TracerProvider = None
+
+HEX = "0123456789abcdef" * 2
 
 
 class Obj:
@@ -128,3 +147,279 @@ class TestInferAdapter(unittest.TestCase):
             self.config.credentials.data_config
         )
         assert source_module[0] == BigQueryAdapter
+
+    def test_load_dataset_is_shared_across_models(self):
+        adapter = InferAdapter(self.config)
+        data_adapter = mock.Mock()
+        data_adapter.execute.return_value = (
+            None,
+            agate.Table([[1, "a"], [2, "b"]], ["id", "name"]),
+        )
+        query = "SELECT * FROM users"
+        _, first = adapter.load_dataset(query, data_adapter)
+        _, second = adapter.load_dataset(query, data_adapter)
+        _, other = adapter.load_dataset("SELECT * FROM feedback", data_adapter)
+        assert first is second
+        assert other is not first
+        assert data_adapter.execute.call_count == 2
+        assert base64.b64decode(first["base64"]).decode().splitlines() == [
+            "id,name",
+            "1,a",
+            "2,b",
+        ]
+
+    @unittest.skipIf(TracerProvider is None, "opentelemetry-sdk is not installed")
+    def test_reused_dataset_span_has_size(self):
+        exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+        adapter = InferAdapter(self.config)
+        data_adapter = mock.Mock()
+        data_adapter.execute.return_value = (None, agate.Table([[10], [20]], ["id"]))
+        with mock.patch.dict(os.environ, {"INFER_TRACING": "1"}), mock.patch.object(
+            tracing, "get_tracer", return_value=provider.get_tracer("test")
+        ):
+            adapter.load_dataset("SELECT * FROM users", data_adapter)
+            adapter.load_dataset("SELECT * FROM users", data_adapter)
+        loaded, reused = exporter.get_finished_spans()
+        assert not loaded.attributes["infer.dataset.reused"]
+        assert reused.attributes["infer.dataset.reused"]
+        for span in (loaded, reused):
+            assert span.attributes["infer.dataset.rows"] == 2
+            assert span.attributes["infer.dataset.bytes"] > 0
+
+    def test_unused_datasets_are_evicted_over_cache_size(self):
+        with mock.patch.dict(os.environ, {"INFER_DATASET_CACHE_MB": "0"}):
+            adapter = InferAdapter(self.config)
+        data_adapter = mock.Mock()
+        data_adapter.execute.return_value = (None, agate.Table([[10]], ["id"]))
+        users, _ = adapter.load_dataset("SELECT * FROM users", data_adapter)
+        adapter.load_dataset("SELECT * FROM users", data_adapter)
+        feedback, _ = adapter.load_dataset("SELECT * FROM feedback", data_adapter)
+
+        # users is still used by one model, feedback by none
+        adapter.release_datasets([users, feedback])
+        assert list(adapter.datasets) == [users]
+        adapter.release_datasets([users])
+        assert not adapter.datasets
+        assert not adapter.dataset_users
+        assert not adapter.dataset_locks
+
+    def test_unused_datasets_are_kept_within_cache_size(self):
+        adapter = InferAdapter(self.config)
+        data_adapter = mock.Mock()
+        data_adapter.execute.return_value = (None, agate.Table([[10]], ["id"]))
+        users, _ = adapter.load_dataset("SELECT * FROM users", data_adapter)
+        adapter.release_datasets([users])
+        adapter.load_dataset("SELECT * FROM users", data_adapter)
+        assert data_adapter.execute.call_count == 1
+
+        adapter.cleanup_connections()
+        assert not adapter.datasets
+
+    def test_invalid_dataset_cache_size(self):
+        with mock.patch.dict(os.environ, {"INFER_DATASET_CACHE_MB": "lots"}):
+            with self.assertRaises(RuntimeException):
+                InferAdapter(self.config)
+
+    def test_load_dataset_spills_over_memory_budget(self):
+        adapter = InferAdapter(self.config)
+        data_adapter = mock.Mock()
+        data_adapter.execute.return_value = (
+            None,
+            agate.Table([[1, "a"], [2, "b"]], ["id", "name"]),
+        )
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(
+            os.environ, {"INFER_MEMORY_BUDGET_MB": "1"}
+        ), mock.patch.object(adapter, "spill_path", lambda name: os.path.join(tmp, name)):
+            _, dataset = adapter.load_dataset("SELECT * FROM users", data_adapter)
+            assert "base64" not in dataset
+            with open(dataset["base64_path"], "rb") as fp:
+                assert base64.b64decode(fp.read()).decode().splitlines() == [
+                    "id,name",
+                    "1,a",
+                    "2,b",
+                ]
+            adapter.clear_datasets()
+            assert not os.path.exists(dataset["base64_path"])
+
+    def test_load_config_applies_to_one_statement(self):
+        adapter = InferAdapter(self.config)
+        adapter.set_load_config({"sample_rows": 10, "sample_method": None})
+        assert adapter.load_configs.config == {"sample_rows": 10}
+        thread_connection = mock.MagicMock()
+        thread_connection.name = "model.X.churn"
+        thread_connection.handle["session"].parse.return_value = {"infer_commands": ["PREDICT"]}
+        with mock.patch.object(
+            adapter.connections, "get_if_exists", return_value=thread_connection
+        ), mock.patch.object(adapter, "get_data_adapter"), mock.patch.object(
+            adapter, "execute_infer"
+        ) as execute_infer:
+            adapter.execute("SELECT * FROM users PREDICT(has_churned)")
+            adapter.execute("SELECT * FROM users PREDICT(has_churned)")
+        assert execute_infer.call_args_list[0].args[-1] == {"sample_rows": 10}
+        assert execute_infer.call_args_list[1].args[-1] == {}
+
+    def test_upload_runs_seed_on_calling_thread(self):
+        adapter = InferAdapter(self.config)
+        data_adapter = mock.Mock(config=self.config)
+        result = mock.Mock(status=None)
+        with tempfile.TemporaryDirectory() as tmp, mock.patch(
+            "dbt.parser.manifest.ManifestLoader"
+        ), mock.patch("dbt.task.seed.SeedTask") as seed_task:
+            seed_task.return_value.run.return_value.results = [result]
+            adapter.config.seed_paths = [os.path.join(tmp, "seeds")]
+            adapter.upload_data_to_table("tmp_infer_result", b"id\n1\n", data_adapter)
+        seed_config = seed_task.call_args.args[1]
+        assert seed_config.args.single_threaded
+        assert not self.config.args.single_threaded
+
+    def test_peak_rss_is_only_reset_with_no_model_running(self):
+        adapter = InferAdapter(self.config)
+        with mock.patch.object(memory, "reset_peak_rss", return_value=True) as reset:
+            with adapter.track_peak_rss():
+                with adapter.track_peak_rss():
+                    pass
+                assert reset.call_count == 1
+            with adapter.track_peak_rss():
+                pass
+        assert reset.call_count == 2
+        assert adapter.infer_models_running == 0
+
+    def test_temp_relations_are_dropped_at_end_of_run(self):
+        adapter = InferAdapter(self.config)
+        adapter.data_adapter = mock.MagicMock(
+            Relation=BigQueryAdapter.Relation, config=self.config
+        )
+        with mock.patch.dict(os.environ, {"INFER_TMP_TABLE_TTL_HOURS": "0"}):
+            first = adapter.create_temp_relation(adapter.data_adapter)
+            second = adapter.create_temp_relation(adapter.data_adapter)
+        assert is_stale_temp_relation(first.identifier, time.time() + 1)
+        assert first.identifier != second.identifier
+
+        # cleanup triggered by the SeedTask used for uploads keeps the temp tables
+        adapter.seeding.active = True
+        adapter.cleanup_connections()
+        adapter.data_adapter.drop_relation.assert_not_called()
+
+        adapter.seeding.active = False
+        adapter.cleanup_connections()
+        dropped = [c.args[0] for c in adapter.data_adapter.drop_relation.call_args_list]
+        assert sorted(r.identifier for r in dropped) == sorted(
+            [first.identifier, second.identifier]
+        )
+        assert adapter.temp_relations == []
+
+    def test_stale_temp_relations_are_swept_on_first_statement(self):
+        adapter = InferAdapter(self.config)
+        data_adapter = mock.MagicMock(Relation=BigQueryAdapter.Relation, config=self.config)
+        stale = BigQueryAdapter.Relation.create(identifier=f"tmp_infer_1000000000_{HEX}")
+        fresh = BigQueryAdapter.Relation.create(identifier=f"tmp_infer_9999999999_{HEX}")
+        users = BigQueryAdapter.Relation.create(identifier="users")
+        data_adapter.list_relations_without_caching.return_value = [stale, fresh, users]
+        thread_connection = mock.MagicMock()
+        thread_connection.handle["session"].parse.return_value = {"infer_commands": []}
+        with mock.patch.object(
+            adapter.connections, "get_if_exists", return_value=thread_connection
+        ), mock.patch.object(adapter, "get_data_adapter", return_value=data_adapter):
+            adapter.execute("SELECT 1")
+            adapter.sweep_thread.join()
+        data_adapter.drop_relation.assert_called_once_with(stale)
+
+    def test_is_stale_temp_relation(self):
+        cutoff = 2000000000
+        assert is_stale_temp_relation(f"tmp_infer_1000000000_{HEX}", cutoff)
+        assert is_stale_temp_relation(f"TMP_INFER_1000000000_{HEX.upper()}", cutoff)
+        assert not is_stale_temp_relation(f"tmp_infer_3000000000_{HEX}", cutoff)
+        assert not is_stale_temp_relation("tmp_infer_2023_backup", cutoff)
+        assert not is_stale_temp_relation("tmp_infer_1000000000_backup", cutoff)
+        assert not is_stale_temp_relation(f"tmp_infer_1000000000_{HEX}_old", cutoff)
+        assert not is_stale_temp_relation(f"tmp_infer_{HEX}", cutoff)
+        assert not is_stale_temp_relation("users", cutoff)
+        assert not is_stale_temp_relation(None, cutoff)
+
+
+class SourceAdapter:
+    def __init__(self, source_type):
+        self.source_type = source_type
+
+    def type(self):
+        return self.source_type
+
+    def quote(self, identifier):
+        return f'"{identifier}"'
+
+
+class TestRewriteLoadQuery(unittest.TestCase):
+    query = "SELECT * FROM users"
+
+    def test_no_config(self):
+        assert rewrite_load_query(self.query, BigQueryAdapter, {}) == self.query
+
+    def test_include_columns(self):
+        assert (
+            rewrite_load_query(
+                self.query, SourceAdapter("postgres"), {"include_columns": ["age", "ltv"]}
+            )
+            == 'SELECT "age", "ltv" FROM (SELECT * FROM users) AS infer_load'
+        )
+
+    def test_exclude_columns(self):
+        assert (
+            rewrite_load_query(self.query, BigQueryAdapter, {"exclude_columns": ["feedback"]})
+            == "SELECT * EXCEPT (`feedback`) FROM (SELECT * FROM users) AS infer_load"
+        )
+        for source_type in ["postgres", "spark"]:
+            with self.assertRaises(RuntimeException):
+                rewrite_load_query(
+                    self.query, SourceAdapter(source_type), {"exclude_columns": ["feedback"]}
+                )
+
+    def test_sample_methods(self):
+        assert (
+            rewrite_load_query(self.query, BigQueryAdapter, {"sample_rows": 10})
+            == "SELECT * FROM (SELECT * FROM users) AS infer_load ORDER BY RAND() LIMIT 10"
+        )
+        assert (
+            rewrite_load_query(self.query, SourceAdapter("snowflake"), {"sample_rows": 10})
+            == "SELECT * FROM (SELECT * FROM users) AS infer_load SAMPLE (10 ROWS)"
+        )
+        assert (
+            rewrite_load_query(
+                self.query,
+                SourceAdapter("postgres"),
+                {"sample_rows": 10, "sample_method": "limit"},
+            )
+            == "SELECT * FROM (SELECT * FROM users) AS infer_load LIMIT 10"
+        )
+
+    def test_hash_sample(self):
+        hash_config = {"sample_method": "hash", "sample_key": "user_id", "sample_modulo": 10}
+        assert rewrite_load_query(self.query, BigQueryAdapter, hash_config) == (
+            "SELECT * FROM (SELECT * FROM users) AS infer_load "
+            "WHERE MOD(FARM_FINGERPRINT(CAST(`user_id` AS STRING)), 10) = 0"
+        )
+        assert rewrite_load_query(
+            self.query, SourceAdapter("snowflake"), {**hash_config, "sample_rows": 5}
+        ) == (
+            "SELECT * FROM (SELECT * FROM users) AS infer_load "
+            'WHERE MOD(HASH("user_id"), 10) = 0 LIMIT 5'
+        )
+        with self.assertRaises(RuntimeException):
+            rewrite_load_query(self.query, SourceAdapter("sqlserver"), hash_config)
+
+    def test_invalid_sample_config(self):
+        for load_config in [
+            {"sample_rows": -1},
+            {"sample_rows": 0},
+            {"sample_rows": True},
+            {"include_columns": "age"},
+            {"exclude_columns": ["age", 1]},
+            {"sample_rows": 10, "sample_method": "tablesample"},
+            {"sample_method": "hash", "sample_modulo": 10},
+            {"sample_method": "hash", "sample_key": "user_id"},
+            {"sample_method": "hash", "sample_key": "user_id", "sample_modulo": True},
+            {"include_columns": ["age"], "exclude_columns": ["ltv"]},
+        ]:
+            with self.assertRaises(RuntimeException):
+                rewrite_load_query(self.query, BigQueryAdapter, load_config)
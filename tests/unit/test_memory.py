@@ -0,0 +1,119 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import agate
+
+from dbt.adapters.infer import memory
+from dbt.adapters.infer.connections import InferSession
+from dbt.exceptions import DbtRuntimeError as RuntimeException
+
+
+class TestMemory(unittest.TestCase):
+    def test_should_spill(self):
+        with mock.patch.dict(os.environ, {"INFER_MEMORY_BUDGET_MB": ""}):
+            assert not memory.should_spill(10**12)
+        with mock.patch.dict(os.environ, {"INFER_MEMORY_BUDGET_MB": "1"}):
+            assert memory.should_spill(0)
+        with mock.patch.dict(os.environ, {"INFER_MEMORY_BUDGET_MB": "1000000"}):
+            assert not memory.should_spill(1024)
+            assert memory.should_spill(10**13)
+
+    def test_estimate_table_size(self):
+        table = agate.Table([[10, "abc"]] * 1000, ["id", "name"])
+        assert memory.estimate_table_size(table) == len("10,abc\n") * 1000 * memory.DATASET_COPIES
+        assert memory.estimate_table_size(agate.Table([], ["id"])) == 0
+
+    def test_b64encode_file_and_count_lines(self):
+        data = b"".join(b"%d,row\n" % i for i in range(200000))
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = os.path.join(tmp, "data.csv"), os.path.join(tmp, "data.b64")
+            with open(src, "wb") as fp:
+                fp.write(data)
+            memory.b64encode_file(src, dst)
+            with open(dst, "rb") as fp:
+                assert fp.read() == base64.b64encode(data)
+            assert memory.count_lines(src) == 200000
+            open(src, "wb").close()
+            assert memory.count_lines(src) == 0
+
+    def test_invalid_memory_budget(self):
+        for value in ["lots", "-1"]:
+            with mock.patch.dict(os.environ, {"INFER_MEMORY_BUDGET_MB": value}):
+                with self.assertRaises(RuntimeException):
+                    memory.memory_budget()
+
+    def test_peak_rss(self):
+        if memory.reset_peak_rss():
+            before = memory.peak_rss()
+            data = b"x" * (64 * 1024 * 1024)
+            assert memory.peak_rss() >= before + len(data) // 2
+        elif memory.peak_rss() is not None:
+            assert memory.peak_rss() > 0
+
+
+class TestInferSessionSpill(unittest.TestCase):
+    def test_dbt_run_streams_spilled_datasets(self):
+        session = object.__new__(InferSession)
+        session._InferSession__url = "http://infer/api/v1"
+        session._InferSession__session = mock.Mock()
+        bodies = []
+
+        def request(method, url, data=None, json=None):
+            bodies.append(data.read() if data else None)
+            return mock.Mock(status_code=200, json=lambda: {"id": 1})
+
+        session._InferSession__session.request.side_effect = request
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tmp_a.b64")
+            with open(path, "wb") as fp:
+                fp.write(base64.b64encode(b"id\n1\n"))
+            datasets = [
+                {"base64_path": path, "filename": "tmp_a", "table_query": "SELECT 1"},
+                {"base64": "aWQKMgo=", "filename": "tmp_b", "table_query": "SELECT 2"},
+            ]
+            assert session.dbt_run("dbt_run", "SELECT * FROM a PREDICT(id)", datasets) == 1
+
+        body = json.loads(bodies[0])
+        assert body["dbt_run"]["query"] == "SELECT * FROM a PREDICT(id)"
+        assert body["dbt_run"]["datasets"] == [
+            {"base64": "aWQKMQo=", "filename": "tmp_a", "table_query": "SELECT 1"},
+            {"base64": "aWQKMgo=", "filename": "tmp_b", "table_query": "SELECT 2"},
+        ]
+
+    def test_get_dbt_result_closes_failed_download(self):
+        session = object.__new__(InferSession)
+        session._InferSession__url = "http://infer/api/v1"
+        session._InferSession__baseurl = "http://infer"
+        session._InferSession__session = mock.Mock()
+        status = mock.Mock(status_code=200)
+        status.json.return_value = {"status": "COMPLETED", "output_url": "/output.csv"}
+        download = mock.MagicMock(status_code=500)
+        download.__enter__.return_value = download
+        session._InferSession__session.request.side_effect = [status, download]
+        with self.assertRaises(RuntimeError):
+            session.get_dbt_result(1)
+        download.__exit__.assert_called_once()
+
+    def test_get_dbt_result_spills_result_of_unknown_size(self):
+        session = object.__new__(InferSession)
+        session._InferSession__url = "http://infer/api/v1"
+        session._InferSession__baseurl = "http://infer"
+        session._InferSession__session = mock.Mock()
+        status = mock.Mock(status_code=200)
+        status.json.return_value = {"status": "COMPLETED", "output_url": "/output.csv"}
+        download = mock.MagicMock(status_code=200, headers={})
+        download.__enter__.return_value = download
+        download.iter_content.return_value = [b"id\n", b"1\n"]
+        session._InferSession__session.request.side_effect = [status, download]
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(
+            os.environ, {"INFER_MEMORY_BUDGET_MB": "1000000"}
+        ):
+            spill_path = os.path.join(tmp, "result.csv")
+            _, result, _ = session.get_dbt_result(1, spill_path)
+            assert result == spill_path
+            with open(spill_path, "rb") as fp:
+                assert fp.read() == b"id\n1\n"
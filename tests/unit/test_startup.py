@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from dbt.adapters.factory import load_plugin
+from dbt.adapters.infer import InferConnectionManager
+
+# opt-in limit on the import cost of the infer adapter on top of dbt.adapters.base, in milliseconds
+IMPORT_BUDGET_MS = os.getenv("INFER_IMPORT_BUDGET_MS")
+
+IMPORT_BENCHMARK = """
+import json, sys, time
+start = time.perf_counter()
+import dbt.adapters.base
+base = time.perf_counter()
+import dbt.adapters.infer
+end = time.perf_counter()
+print(json.dumps({
+    "base_ms": (base - start) * 1000,
+    "infer_ms": (end - base) * 1000,
+    "modules": sorted(sys.modules),
+}))
+"""
+
+DATA_CONFIG = {
+    "type": "bigquery",
+    "keyfile": "some_file.json",
+    "method": "service-account-json",
+    "project": "project_id",
+    "schema": "schema",
+    "threads": 1,
+}
+
+
+class TestInferStartup(unittest.TestCase):
+    def setUp(self):
+        InferConnectionManager._source_modules.clear()
+        InferConnectionManager._source_credentials.clear()
+
+    def test_import_does_not_load_heavy_modules(self):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_BENCHMARK])
+        result = json.loads(output)
+        assert "dbt.task.seed" not in result["modules"]
+        assert "dbt.parser.manifest" not in result["modules"]
+
+    @unittest.skipUnless(IMPORT_BUDGET_MS, "INFER_IMPORT_BUDGET_MS is not set")
+    def test_import_benchmark(self):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_BENCHMARK])
+        result = json.loads(output)
+        assert result["infer_ms"] < float(IMPORT_BUDGET_MS)
+
+    def test_source_module_is_loaded_once(self):
+        with mock.patch(
+            "dbt.adapters.infer.connections.load_plugin", wraps=load_plugin
+        ) as patched:
+            first = InferConnectionManager.get_source_module(DATA_CONFIG)
+            second = InferConnectionManager.get_source_module(dict(DATA_CONFIG))
+        assert first is second
+        assert patched.call_count == 1
+
+    def test_source_credentials_are_resolved_once_per_data_config(self):
+        first = InferConnectionManager.get_source_credentials(DATA_CONFIG)
+        second = InferConnectionManager.get_source_credentials(dict(DATA_CONFIG))
+        other = InferConnectionManager.get_source_credentials({**DATA_CONFIG, "schema": "other"})
+        assert first is second
+        assert other is not first
+        assert other.schema == "other"
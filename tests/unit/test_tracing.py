@@ -0,0 +1,63 @@
+import os
+import pstats
+import tempfile
+import unittest
+from unittest import mock
+
+from dbt.adapters.infer import tracing
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+except ImportError:
+    trace = None
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        tracing.get_tracer.cache_clear()
+
+    def test_span_is_noop_by_default(self):
+        with mock.patch.dict(os.environ, {"INFER_TRACING": ""}):
+            with tracing.span("infer.test", key="value"):
+                tracing.set_attribute("other", 1)
+            assert tracing.traced("infer.test")(lambda x: x + 1)(1) == 2
+
+    @unittest.skipIf(trace is None, "opentelemetry-sdk is not installed")
+    def test_spans_are_recorded(self):
+        exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+        with mock.patch.dict(os.environ, {"INFER_TRACING": "1"}), mock.patch.object(
+            tracing, "get_tracer", return_value=provider.get_tracer("test")
+        ):
+
+            @tracing.traced("infer.execute")
+            def execute():
+                with tracing.span("infer.http", **{"http.method": "GET"}):
+                    tracing.set_attribute("http.status_code", 200)
+                tracing.set_attribute("infer.job_id", 1)
+
+            execute()
+        http, outer = exporter.get_finished_spans()
+        assert http.name == "infer.http"
+        assert dict(http.attributes) == {"http.method": "GET", "http.status_code": 200}
+        assert outer.name == "infer.execute"
+        assert dict(outer.attributes) == {"infer.job_id": 1}
+        assert http.parent.span_id == outer.context.span_id
+
+    def test_profile_writes_pstats(self):
+        with tempfile.TemporaryDirectory() as target:
+            path = os.path.join(target, "infer_profiles", "model.X.churn.pstats")
+            with mock.patch.dict(os.environ, {"INFER_PROFILE": ""}):
+                with tracing.profile(path):
+                    pass
+            assert not os.path.exists(path)
+            with mock.patch.dict(os.environ, {"INFER_PROFILE": "1"}):
+                with tracing.profile(path):
+                    sum(range(10))
+            assert pstats.Stats(path).total_calls > 0